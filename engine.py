@@ -1,8 +1,107 @@
+import sys
+from functools import lru_cache
+
 import numpy as np
 
 # configure numpy to render floats with 3 decimal places
 np.set_printoptions(formatter={"float": "{: 0.3f}".format})
 
+# dtype used for tensors created from Python scalars, lists and non-float arrays
+DEFAULT_DTYPE = np.float32
+
+
+# free buffers keyed by (shape, dtype), filled by Tensor.release_graph so that the
+# next forward and backward pass can reuse them instead of allocating new arrays
+_POOL = {}
+
+# maximum number of free buffers kept per (shape, dtype)
+_POOL_LIMIT = 16
+
+# forward ops only write into pooled buffers once release_graph has been used, so
+# training loops that never release their graphs skip the pool bookkeeping
+_pool_in_use = False
+
+
+def _alloc(shape: tuple, dtype) -> np.ndarray:
+    """Take an uninitialized buffer from the pool, or allocate a new one."""
+    buffers = _POOL.get((shape, np.dtype(dtype)))
+    return buffers.pop() if buffers else np.empty(shape, dtype)
+
+
+def _release(buffer) -> None:
+    """Return a buffer to the pool, views and scalars are skipped."""
+    if not isinstance(buffer, np.ndarray) or not buffer.ndim or not buffer.flags.owndata:
+        return
+
+    buffers = _POOL.setdefault((buffer.shape, buffer.dtype), [])
+    if len(buffers) < _POOL_LIMIT:
+        buffers.append(buffer)
+
+
+# shape bookkeeping only depends on the shapes involved, which recur on every training
+# iteration, so it is cached instead of being recomputed for every op
+@lru_cache(maxsize=4096)
+def _broadcast_shape(*shapes) -> tuple:
+    """Cached np.broadcast_shapes."""
+    return np.broadcast_shapes(*shapes)
+
+
+def _pooled(ufunc, *arrays) -> np.ndarray:
+    """Apply an element-wise ufunc, writing the result into a pooled buffer."""
+    if not _pool_in_use:
+        return ufunc(*arrays)
+
+    shape = _broadcast_shape(*(np.shape(a) for a in arrays))
+    return ufunc(*arrays, out=_alloc(shape, np.result_type(*arrays)))
+
+
+@lru_cache(maxsize=4096)
+def broadcast_axes(grad_shape: tuple, target_shape: tuple):
+    """Find the axes along which a Tensor of the target shape was broadcast.
+
+    The result only depends on the shapes, so ops compute it once in the forward pass.
+
+    Args:
+        grad_shape: The shape of the gradient, i.e. of the broadcast result.
+        target_shape: The shape of the target Tensor.
+
+    Returns:
+        The axes the gradient has to be summed over, or None if no reduction is needed.
+    """
+
+    if grad_shape == target_shape:
+        return None
+
+    # leading axes missing from the target were broadcast
+    n_lead = len(grad_shape) - len(target_shape)
+    axes = list(range(n_lead))
+
+    # as were axes where the target has size 1 and the gradient is larger
+    for i, tar_axis in enumerate(target_shape):
+        if tar_axis == 1 and grad_shape[n_lead + i] != 1:
+            axes.append(n_lead + i)
+
+    return tuple(axes)
+
+
+def reduce_gradient(gradient: np.ndarray, axes, target_shape: tuple) -> np.ndarray:
+    """Reduce the gradient along precomputed broadcast axes.
+
+    Args:
+        gradient: The gradient to reduce.
+        axes: The broadcast axes as returned by broadcast_axes.
+        target_shape: The shape of the target Tensor.
+
+    Returns:
+        The reduced gradient.
+    """
+
+    # a scalar gradient broadcasts to any shape, return it as is
+    if axes is None or gradient.ndim == 0:
+        return gradient
+
+    return np.sum(gradient, axis=axes, keepdims=True).reshape(target_shape)
+
 
 def reshape_gradient(gradient: np.ndarray, target_shape: tuple) -> np.ndarray:
     """Reshape the gradient to match the shape of the target Tensor.
@@ -15,90 +114,353 @@ def reshape_gradient(gradient: np.ndarray, target_shape: tuple) -> np.ndarray:
         The reshaped gradient.
     """
 
-    # if the gradient has the same shape as the target shape, return the gradient
-    if gradient.shape == target_shape:
+    if gradient.ndim == 0:
         return gradient
 
-    # if the target shape is scalar, return the sum of the gradient
-    if target_shape == ():
-        return np.sum(gradient)
+    axes = broadcast_axes(gradient.shape, target_shape)
+    return reduce_gradient(gradient, axes, target_shape)
 
-    # if the target shape is a vector, expand the dimension
-    keepdims = True
-    while len(target_shape) != len(gradient.shape):
-        target_shape = (1, *target_shape)
-        keepdims = False
 
-    # otherwise, we need reduce the gradient along axes that were broadcast
-    broadcast_axes = []
-    for i, (grad_axis, tar_axis) in enumerate(zip(gradient.shape, target_shape)):
-        # if the target axis is 1 and the gradient is larger, then
-        # the Tensor was broadcast along this axis
-        if tar_axis == 1 and grad_axis != 1:
-            broadcast_axes.append(i)
+def batched_matmul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Matrix product of two arrays, where only the left operand may be batched.
 
-    return np.sum(gradient, axis=tuple(broadcast_axes), keepdims=keepdims)
+    np.matmul runs one small GEMM per batch entry when a batched array is multiplied
+    by a plain matrix; folding the batch axes into the rows runs a single large GEMM.
 
+    Args:
+        a: The left operand.
+        b: The right operand.
+
+    Returns:
+        The same result as np.matmul(a, b).
+    """
 
-def back_none():
+    # (..., M, K) @ (K, N): fold the batch axes into the rows
+    if a.ndim > 2 and b.ndim == 2:
+        rows = np.matmul(a.reshape(-1, a.shape[-1]), b)
+        return rows.reshape(*a.shape[:-1], b.shape[-1])
+
+    return np.matmul(a, b)
+
+
+# +++++++++++++++++ Backward Functions +++++++++++++++++
+
+# each op tags its output with an op id and a context tuple holding whatever its
+# backward needs, the backward pass then looks up the handler in BACKWARDS.
+# element-wise handlers build their local gradient in a single scratch array
+# and update it in place, so each one costs one temporary rather than several
+(
+    OP_NONE,
+    OP_ADD,
+    OP_MUL,
+    OP_NEG,
+    OP_SUB,
+    OP_MATMUL,
+    OP_POW,
+    OP_SIN,
+    OP_COS,
+    OP_EXP,
+    OP_LOG,
+    OP_SUM,
+    OP_STACK,
+    OP_T,
+    OP_RELU,
+    OP_SIGMOID,
+    OP_TANH,
+    OP_CE_LOSS,
+    OP_REG_LOSS,
+) = range(19)
+
+# ops whose output data is written by _pooled, release_graph only pools their data
+_POOLED_OPS = frozenset(
+    (OP_ADD, OP_MUL, OP_NEG, OP_SUB, OP_POW, OP_SIN, OP_COS, OP_EXP, OP_LOG, OP_RELU, OP_TANH)
+)
+
+
+def _none_backward(out):
     return None
 
 
+def _add_backward(out):
+    self, other, self_axes, other_axes = out._ctx
+    self._accum_grad(reduce_gradient(out.grad, self_axes, self.data.shape))
+    other._accum_grad(reduce_gradient(out.grad, other_axes, other.data.shape))
+
+
+def _accum_product(tensor, factor, grad, axes):
+    """Accumulate factor * grad into the gradient of tensor."""
+    if axes is not None or not _pool_in_use:
+        tensor._accum_grad(reduce_gradient(factor * grad, axes, tensor.data.shape))
+        return
+
+    # no reduction needed, multiply straight into a pooled buffer and either adopt it
+    # as the gradient or add it in place and hand it back to the pool
+    buffer = _alloc(tensor.data.shape, tensor.data.dtype)
+    np.multiply(factor, grad, out=buffer)
+    if tensor.grad is None:
+        tensor.grad = buffer
+    else:
+        tensor._accum_grad(buffer)
+        _release(buffer)
+
+
+def _mul_backward(out):
+    self, other, self_axes, other_axes = out._ctx
+    _accum_product(self, other.data, out.grad, self_axes)
+    _accum_product(other, self.data, out.grad, other_axes)
+
+
+def _neg_backward(out):
+    (self,) = out._ctx
+    self._accum_grad(out.grad, np.subtract)
+
+
+def _sub_backward(out):
+    self, other, self_axes, other_axes = out._ctx
+    self._accum_grad(reduce_gradient(out.grad, self_axes, self.data.shape))
+    other_grad = reduce_gradient(out.grad, other_axes, other.data.shape)
+    other._accum_grad(other_grad, np.subtract)
+
+
+def _matmul_backward(out):
+    self, other = out._ctx
+    a, b = self.data, other.data
+
+    # promote vectors to matrices the same way np.matmul does
+    if a.ndim == 1:
+        a = a[None, :]
+    if b.ndim == 1:
+        b = b[:, None]
+    batch_shape = _broadcast_shape(a.shape[:-2], b.shape[:-2])
+    grad = np.reshape(out.grad, batch_shape + (a.shape[-2], b.shape[-1]))
+
+    if a.ndim > 2 and b.ndim == 2:
+        # the gradient of b sums over the batch, which is one GEMM over the folded rows
+        self_grad = batched_matmul(grad, b.T)
+        a_rows = a.reshape(-1, a.shape[-1])
+        other_grad = np.matmul(a_rows.T, grad.reshape(-1, grad.shape[-1]))
+    else:
+        # swapaxes only transposes the two matrix axes, so batched inputs work as well;
+        # batch axes that were broadcast are summed out by reshape_gradient
+        self_grad = np.matmul(grad, b.swapaxes(-1, -2))
+        other_grad = np.matmul(a.swapaxes(-1, -2), grad)
+    self._accum_grad(reshape_gradient(self_grad, a.shape).reshape(self.data.shape))
+    other._accum_grad(reshape_gradient(other_grad, b.shape).reshape(other.data.shape))
+
+
+def _pow_backward(out):
+    self, other = out._ctx
+    if other == 2:
+        local_grad = 2 * self.data
+    elif other > 0 and float(other).is_integer():
+        # integer powers are a few multiplies, cheaper than the zero scan the
+        # division below needs
+        local_grad = other * (self.data)**(other - 1)
+    elif np.all(self.data != 0):
+        # x**(n-1) == x**n / x, reuse the forward result instead of a fractional or
+        # negative power pass
+        local_grad = other * out.data / self.data
+    else:
+        local_grad = other * (self.data)**(other - 1)
+    local_grad *= out.grad
+    self._accum_grad(local_grad)
+
+
+def _sin_backward(out):
+    (self,) = out._ctx
+    local_grad = np.cos(self.data)
+    local_grad *= out.grad
+    self._accum_grad(local_grad)
+
+
+def _cos_backward(out):
+    (self,) = out._ctx
+    local_grad = np.sin(self.data)
+    local_grad *= out.grad
+    self._accum_grad(local_grad, np.subtract)
+
+
+def _exp_backward(out):
+    (self,) = out._ctx
+    # d(exp)/dx = exp, reuse the forward result
+    self._accum_grad(out.data * out.grad)
+
+
+def _log_backward(out):
+    (self,) = out._ctx
+    self._accum_grad(out.grad / self.data)
+
+
+def _sum_backward(out):
+    (self,) = out._ctx
+    self._accum_grad(out.grad)
+
+
+def _stack_backward(out):
+    self, other, axis = out._ctx
+    # moveaxis returns a view, so the slices along the stacking axis are not copied
+    grads = np.moveaxis(out.grad, axis, 0)
+    self._accum_grad(grads[0])
+    other._accum_grad(grads[1])
+
+
+def _t_backward(out):
+    (self,) = out._ctx
+    self._accum_grad(out.grad.T)
+
+
+def _relu_backward(out):
+    (self,) = out._ctx
+    self._accum_grad(np.where(self.data > 0, out.grad, 0))
+
+
+def _sigmoid_backward(out):
+    (self,) = out._ctx
+    # d(sigmoid)/dx = sigmoid * (1 - sigmoid), reuse the forward result
+    local_grad = 1 - out.data
+    local_grad *= out.data
+    local_grad *= out.grad
+    self._accum_grad(local_grad)
+
+
+def _tanh_backward(out):
+    (self,) = out._ctx
+    # d(tanh)/dx = 1 - tanh**2, reuse the forward result
+    local_grad = np.square(out.data)
+    local_grad -= 1
+    local_grad *= out.grad
+    self._accum_grad(local_grad, np.subtract)
+
+
+def _ce_loss_backward(out):
+    self, log_sigma, target = out._ctx
+    # (sigma - one_hot) / N, with the one-hot term subtracted only at the target entries
+    N = log_sigma.shape[0]
+    scale = out.grad / N
+    local_grad = np.exp(log_sigma)
+    local_grad *= scale
+    self._accum_grad(local_grad)
+    self.grad[np.arange(N), target] -= scale
+
+
+def _reg_loss_backward(out):
+    self, reg = out._ctx
+    self._accum_grad((2 * reg * out.grad) * self.data)
+
+
+# indexed by op id
+BACKWARDS = (
+    _none_backward,
+    _add_backward,
+    _mul_backward,
+    _neg_backward,
+    _sub_backward,
+    _matmul_backward,
+    _pow_backward,
+    _sin_backward,
+    _cos_backward,
+    _exp_backward,
+    _log_backward,
+    _sum_backward,
+    _stack_backward,
+    _t_backward,
+    _relu_backward,
+    _sigmoid_backward,
+    _tanh_backward,
+    _ce_loss_backward,
+    _reg_loss_backward,
+)
+
+
 class Tensor:
     """
     A custom tensor class that supports basic operations and automatic differentiation.
 
     Args:
-        data (array-like): Input data to create the tensor.
+        data (array-like): Input data to create the tensor. NumPy arrays are wrapped without copying.
         _parent (tuple, optional): Tuple of parent tensors in the computation graph. Defaults to ().
         _op (str, optional): Operation associated with this tensor. Defaults to ''.
         label (str, optional): Label or name for the tensor. Defaults to ''.
         req_grad (bool, optional): Whether gradient updates should be performed for this tensor. Defaults to False.
         is_weight (bool, optional): Whether the tensor has a batch dimension. Defaults to False. The batch dimension is the first dimension of the tensor.
+        dtype (numpy.dtype, optional): Data type of the tensor. Defaults to None, which keeps the dtype of floating point NumPy input and uses DEFAULT_DTYPE otherwise.
 
     Attributes:
         data (numpy.ndarray): The underlying data stored in the tensor.
         label (str): A label for the tensor.
-        grad (numpy.ndarray): Gradient of the tensor with respect to some loss.
+        grad (numpy.ndarray): Gradient of the tensor with respect to some loss. None until the first backward pass writes to it.
         req_grad (bool): Indicates if gradient updates are to be performed for this tensor.
     """
 
     def __init__(
-        self, data, _parent=(), _op="", label="", req_grad=False, is_weight=False
+        self,
+        data,
+        _parent=(),
+        _op="",
+        label="",
+        req_grad=False,
+        is_weight=False,
+        dtype=None,
     ):
-        self.data = np.array(data)
+        # float inputs keep their precision, so float16 activations stay in float16
+        # and op results are never cast; everything else defaults to float32
+        is_float = isinstance(data, (np.ndarray, np.generic)) and np.issubdtype(
+            data.dtype, np.floating
+        )
+        if dtype is None and not is_float:
+            dtype = DEFAULT_DTYPE
+        self.data = np.asarray(data, dtype=dtype)
         self.label = label
-        self.grad = np.zeros(self.data.shape)
+        self.grad = None
         self.req_grad = req_grad
         self.is_weight = is_weight
         self.grad_divisor = None
 
-        self._backward = back_none
-        self._prev = set(_parent)
+        self._op_id = OP_NONE
+        self._ctx = ()
+        self._prev = tuple(_parent)
         self._op = _op
+        self._released = False
 
-    # +++++++++++++++++ Basic Operations +++++++++++++++++
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
 
-    def __add__(self, other) -> "Tensor":
-        other = other if isinstance(other, Tensor) else Tensor(other)
-        out = Tensor(np.add(self.data, other.data), (self, other), "+")  
+    def _wrap(self, other) -> "Tensor":
+        """Wrap an operand as a Tensor, Python scalars get the float dtype of self."""
+        if isinstance(other, Tensor):
+            return other
+        is_float = np.issubdtype(self.data.dtype, np.floating)
+        if isinstance(other, (int, float)) and is_float:
+            return Tensor(other, dtype=self.data.dtype)
+        return Tensor(other)
 
-        def _backward():
-            self.grad += reshape_gradient(out.grad, self.data.shape)  
-            other.grad += reshape_gradient(out.grad, other.data.shape)  
+    # +++++++++++++++++ Basic Operations +++++++++++++++++
 
-        out._backward = _backward
+    def __add__(self, other) -> "Tensor":
+        other = self._wrap(other)
+        out = Tensor(_pooled(np.add, self.data, other.data), (self, other), "+")
+
+        out._op_id = OP_ADD
+        out._ctx = (
+            self,
+            other,
+            broadcast_axes(out.data.shape, self.data.shape),
+            broadcast_axes(out.data.shape, other.data.shape),
+        )
         return out
 
     def __mul__(self, other) -> "Tensor":
-        other = other if isinstance(other, Tensor) else Tensor(other)
-        out = Tensor(np.multiply(self.data, other.data), (self, other), "*")  
-
-        def _backward():
-            self.grad += reshape_gradient(other.data * out.grad, self.data.shape)  
-            other.grad += reshape_gradient(self.data * out.grad, other.data.shape)  
-
-        out._backward = _backward
+        other = self._wrap(other)
+        out = Tensor(_pooled(np.multiply, self.data, other.data), (self, other), "*")
+
+        out._op_id = OP_MUL
+        out._ctx = (
+            self,
+            other,
+            broadcast_axes(out.data.shape, self.data.shape),
+            broadcast_axes(out.data.shape, other.data.shape),
+        )
         return out
 
     def matmul(self, other) -> "Tensor":
@@ -107,35 +469,44 @@ class Tensor:
         elif isinstance(other, Tensor):
             pass
         else:
-            other = Tensor(other)
-        out = Tensor(np.matmul(self.data, other.data))  
-
-        def _backward():
-            self.grad += np.matmul(out.grad, other.data.T)  
-            other.grad += np.matmul(self.data.T, out.grad)  
+            other = self._wrap(other)
+        out = Tensor(batched_matmul(self.data, other.data), (self, other), "@")  
 
-        out._backward = _backward
+        out._op_id = OP_MATMUL
+        out._ctx = (self, other)
         return out
 
     def __pow__(self, other) -> "Tensor":
         assert isinstance(other, (int, float))
-        out = Tensor(np.power(self.data, other), (self,), f"**{other}")  
+        out = Tensor(_pooled(np.power, self.data, other), (self,), f"**{other}")
 
-        def _backward():
-            self.grad += other * (self.data)**(other - 1) * out.grad  
-
-        out._backward = _backward
+        out._op_id = OP_POW
+        out._ctx = (self, other)
 
         return out
 
     def __sub__(self, other) -> "Tensor":
-        return self + (-other)
+        other = self._wrap(other)
+        out = Tensor(_pooled(np.subtract, self.data, other.data), (self, other), "-")
+
+        out._op_id = OP_SUB
+        out._ctx = (
+            self,
+            other,
+            broadcast_axes(out.data.shape, self.data.shape),
+            broadcast_axes(out.data.shape, other.data.shape),
+        )
+        return out
 
     def __matmul__(self, other) -> "Tensor":
         return self.matmul(other)
 
     def __neg__(self) -> "Tensor":
-        return self * -1
+        out = Tensor(_pooled(np.negative, self.data), (self,), "neg")
+
+        out._op_id = OP_NEG
+        out._ctx = (self,)
+        return out
 
     def __truediv__(self, other) -> "Tensor":
         return self * (other**-1)
@@ -144,7 +515,7 @@ class Tensor:
         return self + other
 
     def __rsub__(self, other) -> "Tensor":
-        return (-self) + other
+        return self._wrap(other) - self
 
     def __rmul__(self, other) -> "Tensor":
         return self * other
@@ -158,42 +529,34 @@ class Tensor:
     # +++++++++++++++++ Basic Functions +++++++++++++++++
 
     def sin(self) -> "Tensor":
-        out = Tensor(np.sin(self.data), (self,), "sin")  
-
-        def _backward():
-            self.grad += np.cos(self.data) * out.grad  
+        out = Tensor(_pooled(np.sin, self.data), (self,), "sin")
 
-        out._backward = _backward
+        out._op_id = OP_SIN
+        out._ctx = (self,)
 
         return out
 
     def cos(self) -> "Tensor":
-        out = Tensor(np.cos(self.data), (self,), "cos")  
+        out = Tensor(_pooled(np.cos, self.data), (self,), "cos")
 
-        def _backward():
-            self.grad -= np.sin(self.data) * out.grad  
-
-        out._backward = _backward
+        out._op_id = OP_COS
+        out._ctx = (self,)
 
         return out
 
     def exp(self) -> "Tensor":
-        out = Tensor(np.exp(self.data), (self,), "exp")  
-
-        def _backward():
-            self.grad += np.exp(self.data) * out.grad  
+        out = Tensor(_pooled(np.exp, self.data), (self,), "exp")
 
-        out._backward = _backward
+        out._op_id = OP_EXP
+        out._ctx = (self,)
 
         return out
 
     def log(self) -> "Tensor":
-        out = Tensor(np.log(self.data), (self,), "log")  
-
-        def _backward():
-            self.grad += (1/self.data) * out.grad  
+        out = Tensor(_pooled(np.log, self.data), (self,), "log")
 
-        out._backward = _backward
+        out._op_id = OP_LOG
+        out._ctx = (self,)
 
         return out
 
@@ -202,66 +565,54 @@ class Tensor:
     def sum(self, axis=None) -> "Tensor":
         out = Tensor(np.sum(self.data, axis=axis), (self,), "sum")  
 
-        def _backward():
-            self.grad += out.grad  
-
-        out._backward = _backward
+        out._op_id = OP_SUM
+        out._ctx = (self,)
 
         return out
 
     def stack(self, other, axis=0) -> "Tensor":
-        other = other if isinstance(other, Tensor) else Tensor(other)
+        other = self._wrap(other)
         out = Tensor(
             np.stack((self.data, other.data), axis=axis), (self, other), "stack"
         )
 
-        def _backward():
-            self.grad += out.grad[0]
-            other.grad += out.grad[1]
-
-        out._backward = _backward
+        out._op_id = OP_STACK
+        out._ctx = (self, other, axis)
 
         return out
 
     def T(self) -> "Tensor":
         out = Tensor(self.data.T, (self,), "T")
 
-        def _backward():
-            self.grad += out.grad.T
-
-        out._backward = _backward
+        out._op_id = OP_T
+        out._ctx = (self,)
 
         return out
 
     # +++++++++++++++++ Activation Functions +++++++++++++++++
 
     def relu(self) -> "Tensor":
-        out = Tensor(np.maximum(0, self.data), (self,), "relu")  
+        out = Tensor(_pooled(np.maximum, self.data, 0), (self,), "relu")
 
-        def _backward():
-            self.grad += (self.data > 0) * out.grad  
-
-        out._backward = _backward
+        out._op_id = OP_RELU
+        out._ctx = (self,)
         return out
 
     def sigmoid(self) -> "Tensor":
-        out = out = Tensor(1 / (1+np.exp(-self.data)), (self,), "sigmoid")  
-
-        def _backward():
-            self.grad += np.exp(-self.data) / ((np.exp(-self.data) + 1)**2) * out.grad  
+        # exp(-|x|) never overflows, pick the matching numerator per sign of x
+        neg_abs_exp = np.exp(-np.abs(self.data))
+        sigma = np.where(self.data >= 0, 1, neg_abs_exp) / (1 + neg_abs_exp)
+        out = Tensor(sigma, (self,), "sigmoid")  
 
-        out._backward = _backward
+        out._op_id = OP_SIGMOID
+        out._ctx = (self,)
         return out
 
     def tanh(self) -> "Tensor":
-        self_exp = np.exp(self.data)
-        self_neg_exp = np.exp(-self.data)
-        out = Tensor((self_exp-self_neg_exp) / (self_exp+self_neg_exp), (self,), "tanh")  
-
-        def _backward():
-            self.grad += (4*np.exp(2*self.data)) / ((np.exp(2*self.data) + 1)**2) * out.grad  
+        out = Tensor(_pooled(np.tanh, self.data), (self,), "tanh")
 
-        out._backward = _backward
+        out._op_id = OP_TANH
+        out._ctx = (self,)
         return out
 
     # +++++++++++++++++ Loss Functions +++++++++++++++++
@@ -271,69 +622,171 @@ class Tensor:
             isinstance(target, np.ndarray) and len(target.shape) == 1
         ), "target must be a 1D numpy array"
         
-        stable_data = self.data - np.max(self.data, axis=1, keepdims=True)  
-        exp_data = np.exp(stable_data)
-        exp_sum = np.sum(exp_data, axis=1, keepdims=True)  
-        sigma = exp_data / exp_sum 
+        # low precision logits are promoted, the loss is computed in at least float32
+        loss_dtype = np.promote_types(self.data.dtype, np.float32)
+        logits = self.data.astype(loss_dtype, copy=False)
 
-        N = sigma.shape[0] 
-        
-        one_hot_target = np.zeros_like(sigma)
-        one_hot_target[np.arange(len(target)), target] = 1
+        # log-softmax through a shifted log-sum-exp, the softmax itself is only
+        # materialized in backward
+        log_sigma = logits - np.max(logits, axis=1, keepdims=True)
+        log_sigma -= np.log(np.sum(np.exp(log_sigma), axis=1, keepdims=True))
+
+        # pick the log-probability of the correct class, no one-hot matrix is built
+        correct = np.take_along_axis(log_sigma, target[:, None], axis=1)
         
-        loss_value = -np.sum(one_hot_target * np.log(sigma))  
+        loss_value = -np.sum(correct)  
         out = Tensor(loss_value, (self,), "c-e_loss")
 
-        def _backward():
-            self.grad += (sigma - one_hot_target) / N  
-
-        out._backward = _backward
+        out._op_id = OP_CE_LOSS
+        out._ctx = (self, log_sigma, target)
         return out
 
     def regularization_loss(self, reg: float) -> "Tensor":
-        out = Tensor(reg*(np.sum(self.data**2)), (self,), "reg_loss")  
+        loss_dtype = np.promote_types(self.data.dtype, np.float32)
+        loss_value = reg * np.sum(np.square(self.data, dtype=loss_dtype))
+        out = Tensor(loss_value, (self,), "reg_loss", dtype=loss_dtype)
 
-        def _backward():
-            self.grad += 2 * reg * self.data * out.grad  
-
-        out._backward = _backward
+        out._op_id = OP_REG_LOSS
+        out._ctx = (self, reg)
         return out
 
     # +++++++++++++++++ Backward Pass and Optimization +++++++++++++++++
 
+    def _accum_grad(self, delta, ufunc=np.add) -> None:
+        """Accumulate a gradient contribution into this tensor's gradient.
+
+        The gradient buffer is allocated on the first write, from the pool once
+        release_graph is in use, and updated in place afterwards.
+
+        Args:
+            delta: The gradient contribution, broadcastable to the shape of the tensor.
+            ufunc: np.add to accumulate the contribution, np.subtract to accumulate its
+                negation.
+        """
+        if isinstance(self.grad, np.ndarray):
+            ufunc(self.grad, delta, out=self.grad)
+        elif self.grad is None and not _pool_in_use:
+            # np.array copies, so the gradient never aliases the contribution
+            grad = np.array(delta, dtype=self.data.dtype)
+            if ufunc is np.subtract:
+                np.negative(grad, out=grad)
+            if grad.shape != self.data.shape:
+                grad = np.broadcast_to(grad, self.data.shape).copy()
+            self.grad = grad
+        elif self.grad is None:
+            delta = np.broadcast_to(delta, self.data.shape)
+            self.grad = _alloc(delta.shape, self.data.dtype)
+            if ufunc is np.subtract:
+                np.negative(delta, out=self.grad)
+            else:
+                np.copyto(self.grad, delta)
+        else:
+            # a scalar gradient, e.g. one left behind by zero_grad
+            self.grad = ufunc(self.grad, np.broadcast_to(delta, self.data.shape))
+
     def backward(self) -> None:
+        if self._released:
+            raise RuntimeError("backward() called on a graph freed by release_graph()")
+
         topo = self._traverse_children()
 
-        self.grad = np.ones(self.data.shape)
+        # a scalar loss is seeded with a scalar, no need to allocate an array of ones
+        if self.data.shape == ():
+            self.grad = self.data.dtype.type(1)
+        else:
+            self.grad = np.ones(self.data.shape, self.data.dtype)
         for node in reversed(topo):
-            node._backward()
+            BACKWARDS[node._op_id](node)
 
     def zero_grad(self) -> None:
-        topo = [self]
-        topo.extend(self._traverse_children())
+        topo = self._traverse_children()
 
         for node in reversed(topo):
-            node.grad = 0
+            if isinstance(node.grad, np.ndarray):
+                # zero in place, the next backward pass accumulates into the same buffer
+                node.grad.fill(0)
+            elif node.grad is not None:
+                node.grad = 0.0
 
     def step(self, learning_rate: float) -> None:
-        topo = [self]
-        topo.extend(self._traverse_children())
+        # the topo order already contains self, so every tensor is updated exactly once
+        topo = self._traverse_children()
+
+        for node in reversed(topo):
+            if node.req_grad and node.grad is not None:
+                # scale the gradient in a pooled scratch buffer, parameters of the same
+                # shape share it, and update the data in place
+                update = _alloc(node.data.shape, node.data.dtype)
+                np.multiply(node.grad, learning_rate, out=update)
+                np.subtract(node.data, update, out=node.data)
+                _release(update)
+
+    def release_graph(self) -> None:
+        """Return the buffers of the intermediate tensors in the graph to the pool.
+
+        Call this once the graph is no longer needed, e.g. after step(). Leaf tensors
+        keep their data and gradients, and this tensor keeps its data and gradient and
+        stays linked to the leaves, so zero_grad() and step() still reach them. The
+        other tensors in the graph have their data and grad set to None and must not be
+        used afterwards; backward() raises on any released tensor.
+
+        Arrays read from an intermediate tensor and still referenced elsewhere, e.g. a
+        saved .data or .grad, a view of one, or a Tensor wrapping one, are left out of
+        the pool, so they keep their values.
+        """
+        global _pool_in_use
+
+        if not self._prev:
+            return
+
+        _pool_in_use = True
+        topo = self._traverse_children()
+        leaves = tuple(node for node in topo if not node._prev)
 
+        # consumers come before their inputs, so a view held by a released output
+        # no longer pins the buffer it was taken from
         for node in reversed(topo):
-            if node.req_grad:
-                node.data -= node.grad * learning_rate
+            if not node._prev or node is self:
+                continue
+
+            data, grad = node.data, node.grad
+            node.data, node.grad = None, None
+            node._ctx, node._prev = (), ()
+            node._released = True
+
+            # only outputs of pooled ops and gradients shaped like their tensor go
+            # back, those are the buffers the next pass asks the pool for; a refcount
+            # of 2 (the local and the argument) means nothing outside holds the array
+            if node._op_id in _POOLED_OPS and sys.getrefcount(data) == 2:
+                _release(data)
+            if (
+                isinstance(grad, np.ndarray)
+                and grad.shape == data.shape
+                and grad.dtype == data.dtype
+                and sys.getrefcount(grad) == 2
+            ):
+                _release(grad)
+
+        self._op_id, self._ctx, self._prev = OP_NONE, (), leaves
+        self._released = True
 
     def _traverse_children(self) -> list:
         topo, visited = [], set()
 
-        def build_topo(node):
-            if node not in visited:
-                visited.add(node)
-                for child in node._prev:
-                    build_topo(child)
+        # iterative post-order DFS, so deep graphs do not hit the recursion limit;
+        # a node is emitted once all of its children have been emitted
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
                 topo.append(node)
+            elif id(node) not in visited:
+                visited.add(id(node))
+                stack.append((node, True))
+                for child in node._prev:
+                    if id(child) not in visited:
+                        stack.append((child, False))
 
-        build_topo(self)
         return topo
 
     def __repr__(self) -> str:
@@ -8,6 +8,40 @@ from pathlib import Path
 import numpy as np
 
 
+def numerical_grad(f, x: np.ndarray, eps: float = 1e-6) -> np.ndarray:
+    """Central finite difference gradient of the scalar function f at x."""
+    grad = np.zeros_like(x)
+    for idx in np.ndindex(x.shape):
+        old = x[idx]
+        x[idx] = old + eps
+        plus = f()
+        x[idx] = old - eps
+        minus = f()
+        x[idx] = old
+        grad[idx] = (plus - minus) / (2 * eps)
+    return grad
+
+
+def gradients_match(fn, *arrays) -> bool:
+    """Compare the gradients of sum(fn(*tensors) ** 2) with finite differences."""
+    from engine import Tensor
+
+    def loss(tensors):
+        return (fn(*tensors) ** 2).sum()
+
+    tensors = [Tensor(array.copy()) for array in arrays]
+    loss(tensors).backward()
+
+    arrays = [array.copy() for array in arrays]
+    for tensor, array in zip(tensors, arrays):
+        expected = numerical_grad(
+            lambda: float(loss([Tensor(a) for a in arrays]).data), array
+        )
+        if not np.allclose(tensor.grad, expected, atol=1e-5):
+            return False
+    return True
+
+
 def backprop(seed: int):
     from engine import Tensor
 
@@ -162,6 +196,33 @@ def activation_functions(seed: int):
     return ret
 
 
+def sigmoid_saturation(seed: int):
+    from engine import Tensor
+
+    np.random.seed(seed)
+    x = Tensor(np.array([-1000.0, 0.0, 1000.0]))
+
+    ret = True
+    try:
+        print("Sigmoid saturation:")
+        # exp(-1000) underflowing to zero is expected, an overflow is not
+        with np.errstate(over="raise", invalid="raise", divide="raise"):
+            out = x.sigmoid()
+            out.sum().backward()
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        sigma = np.array([0.0, 0.5, 1.0])
+        if np.allclose(out.data, sigma) and np.allclose(x.grad, sigma * (1 - sigma)):
+            print("PASSED!")
+        else:
+            print("FAILED! Result does not match expected results.")
+            ret = False
+
+    return ret
+
+
 def backward(seed: int):
     from engine import Tensor
 
@@ -204,6 +265,296 @@ def backward(seed: int):
     return ret
 
 
+def release_graph(seed: int):
+    import engine
+    from engine import Tensor
+
+    np.random.seed(seed)
+    w1 = Tensor(np.random.rand(4, 8), req_grad=True)
+    b1 = Tensor(np.random.rand(8), req_grad=True)
+    w2 = Tensor(np.random.rand(8, 3), req_grad=True)
+    x = np.random.rand(5, 4)
+    target = np.array([0, 1, 2, 0, 1])
+
+    ret = True
+    try:
+        print("Release graph:")
+        pool_sizes, losses = [], []
+        for _ in range(6):
+            hidden = (Tensor(x) @ w1 + b1).tanh()
+            loss = (hidden @ w2).sigmoid().cross_entropy_loss(target)
+            loss.backward()
+            loss.step(learning_rate=0.1)
+            loss.release_graph()
+            loss.zero_grad()
+
+            pool_sizes.append(sum(len(buffers) for buffers in engine._POOL.values()))
+            losses.append(loss.data)
+            grads_zeroed = all(not np.any(w.grad) for w in (w1, b1, w2))
+            if not grads_zeroed:
+                break
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if not grads_zeroed:
+            print("FAILED! Gradients are left non-zero after release_graph.")
+            ret = False
+        elif any(loss is None for loss in losses):
+            print("FAILED! Loss data was released.")
+            ret = False
+        elif len(set(pool_sizes[1:])) != 1:
+            print(f"FAILED! Buffer pool keeps growing: {pool_sizes}")
+            ret = False
+        else:
+            print("PASSED!")
+
+    return ret
+
+
+def release_graph_escaped(seed: int):
+    from engine import Tensor
+
+    np.random.seed(seed)
+    w = Tensor(np.random.rand(4, 3), req_grad=True)
+    x = np.random.rand(5, 4)
+
+    ret = True
+    try:
+        print("Release graph with escaped arrays:")
+        hidden = (Tensor(x) @ w).tanh()
+        detached = Tensor(hidden.data)
+        loss = (hidden * hidden).sum()
+        loss.backward()
+        saved_grad = hidden.grad
+        expected_data, expected_grad = detached.data.copy(), saved_grad.copy()
+        loss.release_graph()
+
+        # later passes reuse the pooled buffers, the escaped arrays must not be among them
+        for _ in range(3):
+            loss = ((Tensor(x) @ w).tanh() * 2.0).sum()
+            loss.backward()
+            loss.release_graph()
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if not np.array_equal(detached.data, expected_data):
+            print("FAILED! Detached tensor data was overwritten.")
+            ret = False
+        elif not np.array_equal(saved_grad, expected_grad):
+            print("FAILED! Saved gradient was overwritten.")
+            ret = False
+        else:
+            print("PASSED!")
+
+    return ret
+
+
+def stack_gradients(seed: int):
+    np.random.seed(seed)
+    a = np.random.rand(3, 2)
+    np.random.seed(seed + 1)
+    b = np.random.rand(3, 2)
+
+    ret = True
+    try:
+        print("Stack gradients:")
+        results = {
+            axis: gradients_match(lambda x, y: x.stack(y, axis=axis), a, b)
+            for axis in (0, 1, -1)
+        }
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if all(results.values()):
+            print("PASSED!")
+        else:
+            failed = [axis for axis, ok in results.items() if not ok]
+            print(f"FAILED! Gradients do not match for axis {failed}.")
+            ret = False
+
+    return ret
+
+
+def matmul_gradients(seed: int):
+    shapes = {
+        "2D @ 2D": ((3, 2), (2, 4)),
+        "1D @ 2D": ((2,), (2, 4)),
+        "2D @ 1D": ((3, 2), (2,)),
+        "1D @ 1D": ((2,), (2,)),
+        "3D @ 2D": ((5, 3, 2), (2, 4)),
+        "2D @ 3D": ((3, 2), (5, 2, 4)),
+        "broadcast batch": ((1, 3, 2), (5, 2, 4)),
+    }
+
+    ret = True
+    try:
+        print("Matmul gradients:")
+        results = {}
+        for i, (name, (a_shape, b_shape)) in enumerate(shapes.items()):
+            np.random.seed(seed + i)
+            a = np.random.rand(*a_shape)
+            b = np.random.rand(*b_shape)
+            results[name] = gradients_match(lambda x, y: x @ y, a, b)
+
+        # gradients have to flow through the product to the tensors before it
+        np.random.seed(seed)
+        a, b = np.random.rand(3, 2), np.random.rand(2, 4)
+        results["chained"] = gradients_match(lambda x, y: x.exp() @ y.sin(), a, b)
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if all(results.values()):
+            print("PASSED!")
+        else:
+            failed = [name for name, ok in results.items() if not ok]
+            print(f"FAILED! Gradients do not match for {failed}.")
+            ret = False
+
+    return ret
+
+
+def broadcast_gradients(seed: int):
+    np.random.seed(seed)
+    a = np.random.rand(4, 3, 2)
+    np.random.seed(seed + 1)
+    b = np.random.rand(3, 1)
+
+    ret = True
+    try:
+        print("Broadcast gradients:")
+        # b is broadcast along a prepended axis and along its size-1 axis at once
+        results = {
+            "add": gradients_match(lambda x, y: x + y, a, b),
+            "mul": gradients_match(lambda x, y: x * y, a, b),
+            "sub": gradients_match(lambda x, y: y - x, a, b),
+        }
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if all(results.values()):
+            print("PASSED!")
+        else:
+            failed = [name for name, ok in results.items() if not ok]
+            print(f"FAILED! Gradients do not match for {failed}.")
+            ret = False
+
+    return ret
+
+
+def dtypes(seed: int):
+    from engine import Tensor
+
+    np.random.seed(seed)
+    a = np.random.rand(2, 3)
+
+    ret = True
+    try:
+        print("Data types:")
+        scaled = (Tensor(a) * 0.1).data
+        results = {
+            "list defaults to float32": Tensor([1, 2]).data.dtype == np.float32,
+            "scalar defaults to float32": Tensor(3.0).data.dtype == np.float32,
+            "int array defaults to float32": Tensor(np.arange(3)).dtype == np.float32,
+            "float64 array is kept": Tensor(a).dtype == np.float64,
+            "dtype kwarg": Tensor([1, 2], dtype=np.float64).dtype == np.float64,
+            "scalar operand keeps precision": np.array_equal(scaled, a * 0.1),
+        }
+
+        h = Tensor(a, dtype=np.float16)
+        out = (h * 2 - 1).relu().sigmoid().tanh()
+        out.sum().backward()
+        results["float16 activations"] = out.dtype == np.float16
+        results["float16 gradient"] = h.grad.dtype == np.float16
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if all(results.values()):
+            print("PASSED!")
+        else:
+            failed = [name for name, ok in results.items() if not ok]
+            print(f"FAILED! {failed}")
+            ret = False
+
+    return ret
+
+
+def deep_graph(seed: int):
+    from engine import Tensor
+
+    np.random.seed(seed)
+    a = Tensor(np.random.rand(3))
+    depth = sys.getrecursionlimit() + 4000
+
+    ret = True
+    try:
+        print("Deep graph:")
+        b = a
+        for _ in range(depth):
+            b = b * 1.0001
+        b.sum().backward()
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if np.allclose(a.grad, np.full(3, 1.0001**depth)):
+            print("PASSED!")
+        else:
+            print("FAILED! Result does not match expected results.")
+            ret = False
+
+    return ret
+
+
+def cross_entropy(seed: int):
+    from engine import Tensor
+
+    np.random.seed(seed)
+    cases = [
+        (np.random.randn(5, 4), np.random.randint(0, 4, size=5)),
+        (np.array([[1000.0, 0.0, -1000.0], [-1000.0, 1000.0, 0.0]]), np.array([0, 2])),
+    ]
+
+    ret = True
+    try:
+        print("Cross-entropy loss:")
+        matches = []
+        for logits, target in cases:
+            with np.errstate(over="raise", invalid="raise"):
+                x = Tensor(logits.copy())
+                loss = x.cross_entropy_loss(target)
+                loss.backward()
+
+            log_softmax = logits - np.logaddexp.reduce(logits, axis=1, keepdims=True)
+            expected_loss = -np.sum(log_softmax[np.arange(len(target)), target])
+
+            # the loss sums over the batch while its gradient is averaged
+            arr = logits.copy()
+            expected_grad = numerical_grad(
+                lambda: float(Tensor(arr).cross_entropy_loss(target).data), arr
+            )
+            matches.append(
+                np.allclose(loss.data, expected_loss)
+                and np.allclose(x.grad * len(target), expected_grad, atol=1e-5)
+            )
+    except Exception as e:
+        print(f"FAILED! {e}\n{traceback.format_exc()}")
+        ret = False
+    else:
+        if all(matches):
+            print("PASSED!")
+        else:
+            print("FAILED! Result does not match expected results.")
+            ret = False
+
+    return ret
+
+
 if __name__ == "__main__":
     module_path = Path("./engine.py")
     if not os.path.exists(module_path):
@@ -223,4 +574,13 @@ if __name__ == "__main__":
     basic_operations(seed)
     basic_functions(seed)
     activation_functions(seed)
+    sigmoid_saturation(seed)
     backward(seed)
+    release_graph(seed)
+    release_graph_escaped(seed)
+    stack_gradients(seed)
+    matmul_gradients(seed)
+    broadcast_gradients(seed)
+    dtypes(seed)
+    deep_graph(seed)
+    cross_entropy(seed)